@@ -1,27 +1,75 @@
+import asyncio
 import base64
+import contextvars
+import hashlib
+import ipaddress
 import json
+import logging
 import os
+import random
 import re
+import signal
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Callable, Deque, Dict, List, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
 
+import anyio
+import anyio.to_thread
 import httpx
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import Depends, FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+from starlette.datastructures import UploadFile as StarletteUploadFile
+from starlette.requests import Request
+
+ROOT_ENV_FILE = Path(__file__).resolve().parents[1] / ".env"
+SERVER_ENV_FILE = Path(__file__).resolve().parent / ".env"
 
 try:
-    from dotenv import load_dotenv
+    from .traffic_digest import messages_digest
+except ImportError:
+    from traffic_digest import messages_digest
 
-    root_env = Path(__file__).resolve().parents[1] / ".env"
-    server_env = Path(__file__).resolve().parent / ".env"
-    load_dotenv(root_env)
-    load_dotenv(server_env)
-    load_dotenv()
+try:
+    from dotenv import dotenv_values, find_dotenv
 except Exception:
-    pass
+    dotenv_values = None
+    find_dotenv = None
+
+logger = logging.getLogger("uvicorn.error")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    stop = threading.Event()
+    loop = asyncio.get_running_loop()
+    sighup = getattr(signal, "SIGHUP", None)
+    try:
+        if sighup is not None:
+            loop.add_signal_handler(sighup, SETTINGS.reload)
+    except (NotImplementedError, RuntimeError, ValueError):
+        sighup = None
+    interval = SETTINGS.current.settings_watch_seconds
+    if interval > 0:
+        threading.Thread(
+            target=watch_env_files, args=(stop, interval), daemon=True
+        ).start()
+    try:
+        yield
+    finally:
+        stop.set()
+        if sighup is not None:
+            loop.remove_signal_handler(sighup)
 
-app = FastAPI(title="Menu Analyzer", version="1.0.0")
+
+app = FastAPI(title="Menu Analyzer", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -59,6 +107,30 @@ class AnalyzeResponse(BaseModel):
     risk_level: str
     hits: List[RiskHit]
     suggestions: List[str]
+    failed_images: int = 0
+
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    result: Optional[AnalyzeResponse] = None
+    error: Optional[str] = None
+
+
+class GroupAnalyzeRequest(BaseModel):
+    text: str
+    profiles: List[Preferences] = Field(default_factory=list)
+
+
+class ProfileAnalysis(BaseModel):
+    risk_level: str
+    hits: List[RiskHit]
+    suggestions: List[str]
+
+
+class GroupAnalyzeResponse(BaseModel):
+    menu_items: List[MenuItem]
+    profiles: List[ProfileAnalysis]
 
 
 RISK_ORDER = {"LOW": 0, "MEDIUM": 1, "HIGH": 2}
@@ -92,26 +164,183 @@ ANALYZE_PROMPT = (
 )
 
 
-def get_env(name: str, default: str = "") -> str:
-    value = os.getenv(name, default)
+def get_env(
+    name: str, default: str = "", env: Optional[Mapping[str, str]] = None
+) -> str:
+    value = (os.environ if env is None else env).get(name, default)
     if value is None:
         return default
     return value.strip().strip('"').strip("'")
 
 
-def get_env_float(name: str, default: float) -> float:
-    raw = get_env(name)
+def get_env_float(
+    name: str,
+    default: float,
+    env: Optional[Mapping[str, str]] = None,
+    allow_zero: bool = False
+) -> float:
+    raw = get_env(name, env=env)
     if not raw:
         return default
     try:
         value = float(raw)
     except ValueError:
+        value = -1.0
+    if allow_zero and value == 0:
+        return 0.0
+    if not value > 0:
+        kind = "non-negative" if allow_zero else "positive"
+        raise ValueError(f"{name} must be a {kind} number, got {raw!r}.")
+    return value
+
+
+def get_env_int(
+    name: str, default: int, env: Optional[Mapping[str, str]] = None
+) -> int:
+    raw = get_env(name, env=env)
+    if not raw:
         return default
-    if value <= 0:
-        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise ValueError(f"{name} must be a whole number of at least 1, got {raw!r}.")
     return value
 
 
+class Settings(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    api_key: str = ""
+    base_url: str = "https://gpt.soruxgpt.com/api/api/v1"
+    text_model: str = "gpt-3.5-turbo"
+    image_model: str = "gpt-3.5-turbo"
+    text_model_fast: str = ""
+    image_model_fast: str = ""
+    text_timeout: float = 120.0
+    image_timeout: float = 180.0
+    router_text_max_chars: float = 2000
+    router_max_items: float = 30
+    router_image_max_bytes: float = 1_000_000
+    analyze_image_concurrency: int = 4
+    analyze_image_max_files: int = 8
+    menu_parser_threshold: float = 0.8
+    job_workers: int = 2
+    job_max_pending: int = 100
+    job_ttl_seconds: float = 3600.0
+    job_max_wait_seconds: float = 60.0
+    job_callback_allowed_hosts: Tuple[str, ...] = ()
+    traffic_record_path: str = ""
+    settings_watch_seconds: float = 2.0
+
+
+def env_files() -> List[Path]:
+    files = [ROOT_ENV_FILE, SERVER_ENV_FILE]
+    if find_dotenv is not None:
+        # Search upward from this file, as load_dotenv() did, not from the cwd.
+        found = find_dotenv()
+        if found:
+            files.append(Path(found))
+    return files
+
+
+def read_env_source() -> Dict[str, str]:
+    source: Dict[str, str] = {}
+    if dotenv_values is not None:
+        for path in reversed(env_files()):
+            if path.is_file():
+                values = dotenv_values(path)
+                source.update({key: value for key, value in values.items() if value is not None})
+    source.update(BASE_ENVIRON)
+    return source
+
+
+def load_settings(env: Optional[Mapping[str, str]] = None) -> Settings:
+    env = read_env_source() if env is None else env
+    text_model = get_env("SORUXGPT_TEXT_MODEL", "gpt-3.5-turbo", env)
+    base_url = get_env(
+        "SORUXGPT_BASE_URL", "https://gpt.soruxgpt.com/api/api/v1", env
+    ).rstrip("/")
+    if not base_url.startswith(("http://", "https://")):
+        raise ValueError(f"SORUXGPT_BASE_URL must be an http(s) URL, got {base_url!r}.")
+    timeout = get_env_float("SORUXGPT_TIMEOUT_SECONDS", 0.0, env)
+    return Settings(
+        api_key=get_env("SORUXGPT_API_KEY", env=env),
+        base_url=base_url,
+        text_model=text_model,
+        image_model=get_env("SORUXGPT_IMAGE_MODEL", text_model, env),
+        text_model_fast=get_env("SORUXGPT_TEXT_MODEL_FAST", env=env),
+        image_model_fast=get_env("SORUXGPT_IMAGE_MODEL_FAST", env=env),
+        text_timeout=get_env_float("SORUXGPT_TEXT_TIMEOUT_SECONDS", timeout or 120.0, env),
+        image_timeout=get_env_float("SORUXGPT_IMAGE_TIMEOUT_SECONDS", timeout or 180.0, env),
+        router_text_max_chars=get_env_float("ROUTER_TEXT_MAX_CHARS", 2000, env),
+        router_max_items=get_env_float("ROUTER_MAX_ITEMS", 30, env),
+        router_image_max_bytes=get_env_float("ROUTER_IMAGE_MAX_BYTES", 1_000_000, env),
+        analyze_image_concurrency=get_env_int("ANALYZE_IMAGE_CONCURRENCY", 4, env),
+        analyze_image_max_files=get_env_int("ANALYZE_IMAGE_MAX_FILES", 8, env),
+        menu_parser_threshold=get_env_float("MENU_PARSER_CONFIDENCE_THRESHOLD", 0.8, env),
+        job_workers=get_env_int("JOB_WORKERS", 2, env),
+        job_max_pending=get_env_int("JOB_MAX_PENDING", 100, env),
+        job_ttl_seconds=get_env_float("JOB_TTL_SECONDS", 3600.0, env),
+        job_max_wait_seconds=get_env_float("JOB_MAX_WAIT_SECONDS", 60.0, env),
+        job_callback_allowed_hosts=tuple(
+            host.strip().lower()
+            for host in get_env("JOB_CALLBACK_ALLOWED_HOSTS", env=env).split(",")
+            if host.strip()
+        ),
+        traffic_record_path=get_env("TRAFFIC_RECORD_PATH", env=env),
+        settings_watch_seconds=get_env_float(
+            "SETTINGS_WATCH_SECONDS", 2.0, env, allow_zero=True
+        ),
+    )
+
+
+class SettingsHolder:
+    def __init__(self, settings: Settings) -> None:
+        self.current = settings
+        self.lock = threading.Lock()
+
+    def reload(self) -> bool:
+        with self.lock:
+            try:
+                settings = load_settings()
+            except Exception as exc:
+                logger.warning("Settings reload failed; keeping previous settings: %s", exc)
+                return False
+            self.current = settings
+        METRICS.incr("settings_reloads")
+        logger.info("Settings reloaded.")
+        return True
+
+
+def env_file_mtimes() -> Dict[Path, float]:
+    mtimes = {}
+    for path in env_files():
+        try:
+            mtimes[path] = path.stat().st_mtime
+        except OSError:
+            continue
+    return mtimes
+
+
+def watch_env_files(stop: threading.Event, interval: float) -> None:
+    seen = env_file_mtimes()
+    while not stop.wait(interval):
+        current = env_file_mtimes()
+        if current != seen:
+            seen = current
+            SETTINGS.reload()
+
+
+BASE_ENVIRON = dict(os.environ)
+SETTINGS = SettingsHolder(load_settings())
+
+
+def get_settings() -> Settings:
+    return SETTINGS.current
+
+
 def normalize_term(term: str) -> str:
     return re.sub(r"\s+", "", term.strip().lower())
 
@@ -166,13 +395,183 @@ def naive_items_from_text(text: str) -> List[MenuItem]:
     return items
 
 
-def get_timeout_seconds(name: str, default: float) -> float:
-    return get_env_float(name, get_env_float("SORUXGPT_TIMEOUT_SECONDS", default))
+MENU_SECTION_HEADERS = {
+    "appetizer", "appetizers", "starters", "mains", "main course", "main courses",
+    "entrees", "soups", "salads", "desserts", "drinks", "beverages", "sides",
+    "side dishes", "specials", "凉菜", "冷菜", "热菜", "主食", "主菜", "汤", "汤类",
+    "汤品", "甜品", "甜点", "饮料", "饮品", "酒水", "小吃", "特色菜", "招牌菜",
+    "素菜", "荤菜", "海鲜",
+}
+MENU_BULLET_RE = re.compile(r"^(?:[-•*·●○◆■]+|\d{1,3}[.)、]|[①-⑳])\s*")
+MENU_PRICE_RE = re.compile(
+    r"[\s.·…_\-–—]*(?:[¥￥$€£]\s*)?\d+(?:[.,]\d{1,2})?\s*(?:元|块|rmb|cny|usd)?"
+    r"(?:\s*/\s*\S{1,3})?\s*$",
+    re.IGNORECASE,
+)
+MENU_CURRENCY_RE = re.compile(r"[¥￥$€£]|元|块|rmb|cny|usd|\.\.|…", re.IGNORECASE)
+MENU_SEPARATOR_RE = re.compile(r"\s*(?:(?<!\d):(?!\d)|：|\s[-–—|]\s|\|)\s*")
+MENU_INFO_KEYS = {
+    "tel", "tel.", "phone", "telephone", "mobile", "fax", "add", "add.", "addr",
+    "address", "hours", "opening hours", "open", "open daily", "business hours",
+    "email", "e-mail", "website", "web", "wifi", "wi-fi", "password",
+    "电话", "联系电话", "订餐电话", "外卖电话", "手机", "地址", "店址", "营业时间",
+    "营业", "时间", "网址", "邮箱", "微信", "wifi密码", "密码",
+}
+MENU_INFO_LINE_RE = re.compile(
+    r"^(?:open(?:ing)?(?:\s+hours|\s+daily)?|hours|business\s+hours|tel\.?|phone)\s+\d",
+    re.IGNORECASE,
+)
+MENU_TIME_RE = re.compile(r"\d{1,2}\s*[:：.]\s*\d{2}\s*[-–—~～至到]")
+MENU_ADDRESS_RE = re.compile(
+    r"\d+\s*(?:号|路|街|巷|弄|楼)|\d+\s+\w+\s+(?:st|street|rd|road|ave|avenue|blvd)\b",
+    re.IGNORECASE,
+)
+MENU_PAREN_RE = re.compile(r"^(.*?)\s*[(（]([^)）]+)[)）]\s*$")
+MENU_INGREDIENT_SPLIT_RE = re.compile(r"[，,、/;；|]|\s+and\s+|\s+with\s+", re.IGNORECASE)
+CJK_RE = re.compile(r"[一-鿿]")
+LATIN_RE = re.compile(r"[A-Za-z]")
+
+
+def split_ingredients(raw: str) -> List[str]:
+    return [
+        item.strip(" .-")
+        for item in MENU_INGREDIENT_SPLIT_RE.split(raw)
+        if item.strip(" .-")
+    ]
 
 
-def sorux_base_url() -> str:
-    base = get_env("SORUXGPT_BASE_URL", "https://gpt.soruxgpt.com/api/api/v1")
-    return base.rstrip("/")
+def strip_menu_price(line: str) -> Tuple[str, bool]:
+    match = MENU_PRICE_RE.search(line)
+    if not match:
+        return line, False
+    priced = match.group(0)
+    name = line[: match.start()].strip()
+    # Bare trailing numbers are only prices when set apart from the dish name.
+    explicit = (
+        MENU_CURRENCY_RE.search(priced)
+        or re.match(r"\s*[.·…_\-–—]|\s{2,}", priced)
+        or re.search(r"\d[.,]\d{1,2}\s*$", priced)
+    )
+    if not explicit and not (name and CJK_RE.search(name) and priced[:1].isspace()):
+        return line, False
+    return name, True
+
+
+def is_menu_header(line: str) -> bool:
+    stripped = line.strip()
+    if stripped.startswith(("【", "[")) and stripped.endswith(("】", "]")):
+        return True
+    if stripped.endswith((":", "：")):
+        return True
+    key = stripped.lower().strip(" -=*~")
+    return key in MENU_SECTION_HEADERS
+
+
+def is_menu_noise(line: str) -> bool:
+    meaningful = sum(1 for char in line if char.isalpha())
+    if meaningful < max(1, len(line.replace(" ", "")) // 2):
+        return True
+    if line.endswith((".", "。", "!", "！", "?", "？")):
+        return True
+    if len(line.split()) > 10:
+        return True
+    return len(CJK_RE.findall(line)) > 30
+
+
+def is_menu_info(line: str) -> bool:
+    if MENU_INFO_LINE_RE.match(line):
+        return True
+    parts = MENU_SEPARATOR_RE.split(line, maxsplit=1)
+    if len(parts) != 2:
+        return False
+    key, value = parts[0].strip().lower(), parts[1].strip()
+    if not value:
+        return False
+    if key in MENU_INFO_KEYS:
+        return True
+    # Hours, phone numbers and addresses rather than ingredient lists.
+    digits = sum(1 for char in value if char.isdigit())
+    if digits * 2 >= len(value.replace(" ", "")):
+        return True
+    return bool(MENU_TIME_RE.search(value) or MENU_ADDRESS_RE.search(value))
+
+
+def parse_menu_locally(text: str) -> Tuple[List[MenuItem], float]:
+    entries: List[dict] = []
+    noise = 0
+    for raw_line in text.splitlines():
+        line = MENU_BULLET_RE.sub("", raw_line.strip()).strip()
+        if not line:
+            continue
+        line, has_price = strip_menu_price(line)
+        if not line:
+            if has_price and entries and not entries[-1]["priced"]:
+                entries[-1]["priced"] = True
+            else:
+                noise += 1
+            continue
+        if is_menu_info(line):
+            noise += 1
+            continue
+        if not has_price and is_menu_header(line):
+            continue
+        name, ingredients = line, []
+        paren = MENU_PAREN_RE.match(line)
+        parts = MENU_SEPARATOR_RE.split(line, maxsplit=1)
+        if paren and paren.group(1).strip():
+            name = paren.group(1).strip()
+            ingredients = split_ingredients(paren.group(2))
+        elif len(parts) == 2 and parts[0].strip() and parts[1].strip():
+            name = parts[0].strip()
+            ingredients = split_ingredients(parts[1])
+        elif not has_price and is_menu_noise(line):
+            noise += 1
+            continue
+        name = name.strip(" .·…")
+        if not name:
+            noise += 1
+            continue
+        entries.append(
+            {
+                "name": name,
+                "ingredients": ingredients,
+                "priced": has_price,
+            }
+        )
+
+    merged: List[dict] = []
+    for entry in entries:
+        previous = merged[-1] if merged else None
+        if (
+            previous is not None
+            and not (previous["priced"] and entry["priced"])
+            and not (previous["ingredients"] and entry["ingredients"])
+            and CJK_RE.search(previous["name"])
+            and not LATIN_RE.search(previous["name"])
+            and LATIN_RE.search(entry["name"])
+            and not CJK_RE.search(entry["name"])
+            and not previous.get("paired")
+        ):
+            previous["name"] = f"{previous['name']} {entry['name']}"
+            previous["ingredients"] = previous["ingredients"] or entry["ingredients"]
+            previous["priced"] = previous["priced"] or entry["priced"]
+            previous["paired"] = True
+            continue
+        merged.append(entry)
+
+    if not merged:
+        return [], 0.0
+    # Only lines with extracted ingredients count fully: a bare dish name, even
+    # with a price, says nothing about allergens.
+    score = sum(1.0 if entry["ingredients"] else 0.5 for entry in merged)
+    confidence = score / (len(merged) + noise)
+    if len(merged) < 2:
+        confidence *= 0.5
+    items = [
+        MenuItem(name=entry["name"], ingredients=entry["ingredients"])
+        for entry in merged
+    ]
+    return items, round(confidence, 3)
 
 
 def extract_sorux_error(data: object) -> Optional[str]:
@@ -209,15 +608,212 @@ def looks_like_missing_image(text: str) -> bool:
     return any(marker in normalized for marker in markers)
 
 
+class Metrics:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+        self.latencies: Dict[str, Deque[float]] = {}
+        self.ewma: Dict[str, float] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value_ms: float) -> None:
+        with self.lock:
+            window = self.latencies.setdefault(name, deque(maxlen=500))
+            window.append(value_ms)
+            previous = self.ewma.get(name)
+            self.ewma[name] = value_ms if previous is None else 0.8 * previous + 0.2 * value_ms
+
+    def latency_ewma(self, name: str, min_samples: int = 1) -> Optional[float]:
+        with self.lock:
+            if len(self.latencies.get(name, ())) < min_samples:
+                return None
+            return self.ewma.get(name)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters)
+
+    def latency_snapshot(self) -> Dict[str, dict]:
+        with self.lock:
+            windows = {name: sorted(values) for name, values in self.latencies.items()}
+            ewma = dict(self.ewma)
+        summary = {}
+        for name, values in windows.items():
+            summary[name] = {
+                "count": len(values),
+                "ewma_ms": round(ewma[name], 1),
+                "p50_ms": round(values[len(values) // 2], 1),
+                "p90_ms": round(values[min(len(values) - 1, int(len(values) * 0.9))], 1),
+            }
+        return summary
+
+
+METRICS = Metrics()
+
+
+_traffic_calls: contextvars.ContextVar[Optional[List[dict]]] = contextvars.ContextVar(
+    "traffic_calls", default=None
+)
+
+
+def record_upstream_call(
+    messages: List[dict],
+    model: str,
+    started: float,
+    status: Optional[int],
+    body: Optional[str],
+    error: Optional[str]
+) -> None:
+    calls = _traffic_calls.get()
+    if calls is None:
+        return
+    calls.append(
+        {
+            "digest": messages_digest(messages),
+            "model": model,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "status": status,
+            "body": body,
+            "error": error,
+        }
+    )
+
+
+def sanitize_form_field(value: object) -> dict:
+    if isinstance(value, StarletteUploadFile):
+        data = value.file.read()
+        return {
+            "kind": "file",
+            "content_type": value.content_type,
+            "size": len(data),
+            "sha256": hashlib.sha256(data).hexdigest()[:16],
+        }
+    return {"kind": "field", "value": str(value)}
+
+
+class TrafficRecorderMiddleware:
+    def __init__(self, app, path: str) -> None:
+        self.app = app
+        self.path = Path(path)
+        self.lock = threading.Lock()
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+        replayed = False
+
+        async def replay_receive():
+            nonlocal replayed
+            if replayed:
+                return await receive()
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        status = 0
+        response_chunks = []
+
+        async def capture_send(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_chunks.append(message.get("body", b""))
+            await send(message)
+
+        calls: List[dict] = []
+        token = _traffic_calls.set(calls)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        finally:
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            _traffic_calls.reset(token)
+            record = {
+                "ts": round(time.time(), 3),
+                "method": scope["method"],
+                "path": scope["path"],
+                "request": await self.sanitize_request(scope, body),
+                "status": status,
+                "latency_ms": elapsed_ms,
+                "response": self.decode_body(b"".join(response_chunks)),
+                "upstream": calls,
+            }
+            self.append(record)
+
+    async def sanitize_request(self, scope, body: bytes) -> dict:
+        headers = dict(scope.get("headers") or [])
+        content_type = headers.get(b"content-type", b"").decode("latin-1")
+        if content_type.startswith("multipart/form-data"):
+            sent = False
+
+            async def body_receive():
+                nonlocal sent
+                if sent:
+                    return {"type": "http.disconnect"}
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+
+            try:
+                form = await Request(scope, body_receive).form()
+            except Exception:
+                return {"kind": "multipart", "size": len(body)}
+            fields = [
+                [key, sanitize_form_field(value)]
+                for key, value in form.multi_items()
+            ]
+            await form.close()
+            return {"kind": "multipart", "fields": fields}
+        decoded = self.decode_body(body)
+        if decoded is None:
+            return {"kind": "empty"}
+        return {"kind": "json", "body": decoded}
+
+    @staticmethod
+    def decode_body(body: bytes) -> object:
+        if not body:
+            return None
+        try:
+            return json.loads(body)
+        except Exception:
+            return {"size": len(body)}
+
+    def append(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        with self.lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as handle:
+                handle.write(line + "\n")
+
+
+if SETTINGS.current.traffic_record_path:
+    app.add_middleware(
+        TrafficRecorderMiddleware, path=SETTINGS.current.traffic_record_path
+    )
+
+
 def call_sorux_chat(
     messages: List[dict],
     model: str,
-    timeout: float
+    timeout: float,
+    settings: Settings
 ) -> Tuple[Optional[str], Optional[str]]:
-    api_key = get_env("SORUXGPT_API_KEY")
+    api_key = settings.api_key
     if not api_key:
         return None, "SORUXGPT_API_KEY is not set."
-    url = f"{sorux_base_url()}/chat/completions"
+    url = f"{settings.base_url}/chat/completions"
     payload = {
         "model": model,
         "messages": messages,
@@ -230,6 +826,7 @@ def call_sorux_chat(
         write=timeout,
         pool=timeout
     )
+    started = time.perf_counter()
     try:
         response = httpx.post(
             url,
@@ -238,9 +835,14 @@ def call_sorux_chat(
             timeout=timeout_config
         )
     except httpx.TimeoutException:
+        record_upstream_call(messages, model, started, None, None, "timeout")
         return None, f"timeout after {timeout}s"
     except Exception as exc:
+        record_upstream_call(messages, model, started, None, None, str(exc))
         return None, str(exc)
+    record_upstream_call(
+        messages, model, started, response.status_code, response.text, None
+    )
     try:
         data = response.json()
     except Exception:
@@ -267,8 +869,121 @@ def build_data_url(image_bytes: bytes, mime_type: str) -> str:
     return f"data:{safe_type};base64,{image_b64}"
 
 
-def call_sorux_for_menu_items(text: str) -> Optional[List[MenuItem]]:
-    model = get_env("SORUXGPT_TEXT_MODEL", "gpt-3.5-turbo")
+def tier_model(kind: str, tier: str, settings: Settings) -> str:
+    if kind == "image":
+        return settings.image_model_fast if tier == "fast" else settings.image_model
+    return settings.text_model_fast if tier == "fast" else settings.text_model
+
+
+def estimate_item_count(text: str) -> int:
+    lines = [line for line in text.splitlines() if line.strip()]
+    fragments = [part for part in re.split(r"[,，、;；]", text) if part.strip()]
+    return max(len(lines), len(fragments))
+
+
+# Share of fast-eligible calls still sent to the fast tier while it looks slower,
+# so its latency estimate keeps updating and it can win back traffic.
+ROUTER_FAST_PROBE_SHARE = 0.05
+
+
+def fits_fast_tier(kind: str, features: Dict[str, float], settings: Settings) -> bool:
+    if kind == "image":
+        return features.get("bytes", 0) <= settings.router_image_max_bytes
+    return (
+        features.get("chars", 0) <= settings.router_text_max_chars
+        and features.get("items", 0) <= settings.router_max_items
+    )
+
+
+def route_tiers(
+    kind: str, features: Dict[str, float], settings: Settings
+) -> List[str]:
+    if not tier_model(kind, "fast", settings):
+        METRICS.incr(f"router_{kind}_strong")
+        return ["strong"]
+    small = fits_fast_tier(kind, features, settings)
+    # The fast tier only sees small inputs, so compare it with strong-tier
+    # latency on the same size class rather than on all strong traffic.
+    fast_latency = METRICS.latency_ewma(f"sorux_{kind}_fast", min_samples=5)
+    strong_latency = METRICS.latency_ewma(f"sorux_{kind}_strong_small", min_samples=5)
+    if small and fast_latency is not None and strong_latency is not None:
+        if fast_latency > strong_latency:
+            small = random.random() < ROUTER_FAST_PROBE_SHARE
+            if small:
+                METRICS.incr(f"router_{kind}_probe")
+    tier = "fast" if small else "strong"
+    METRICS.incr(f"router_{kind}_{tier}")
+    return ["fast", "strong"] if small else ["strong"]
+
+
+def call_sorux_routed(
+    messages: List[dict],
+    kind: str,
+    features: Dict[str, float],
+    timeout: float,
+    is_valid: Callable[[str], bool],
+    settings: Settings
+) -> Tuple[Optional[str], Optional[str]]:
+    tiers = route_tiers(kind, features, settings)
+    small = fits_fast_tier(kind, features, settings)
+    content, error = None, None
+    for index, tier in enumerate(tiers):
+        started = time.perf_counter()
+        content, error = call_sorux_chat(
+            messages, tier_model(kind, tier, settings), timeout, settings
+        )
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        METRICS.observe(f"sorux_{kind}_{tier}", elapsed_ms)
+        if tier == "strong" and small:
+            METRICS.observe(f"sorux_{kind}_strong_small", elapsed_ms)
+        last = index == len(tiers) - 1
+        # Errors, empty replies and invalid output all cascade to the next tier.
+        if content and not error and (last or is_valid(content)):
+            return content, None
+        if last:
+            return content, error
+        METRICS.incr(f"router_{kind}_cascade")
+    return content, error
+
+
+def parse_menu_content(content: str) -> Optional[List[MenuItem]]:
+    json_block = extract_json_block(content)
+    if not json_block:
+        return None
+    try:
+        data = json.loads(json_block)
+        return parse_menu_items(data)
+    except Exception:
+        return None
+
+
+def parse_analyze_content(content: str) -> Optional[AnalyzeResponse]:
+    json_block = extract_json_block(content)
+    if not json_block:
+        return None
+    try:
+        parsed = json.loads(json_block)
+    except Exception:
+        return None
+    return parse_analyze_response(parsed)
+
+
+def has_menu_items(content: str) -> bool:
+    return bool(parse_menu_content(content))
+
+
+def has_analysis(content: str) -> bool:
+    analysis = parse_analyze_content(content)
+    return analysis is not None and bool(analysis.menu_items)
+
+
+def text_features(text: str) -> Dict[str, float]:
+    return {"chars": len(text), "items": estimate_item_count(text)}
+
+
+def call_sorux_for_menu_items(
+    text: str, settings: Settings
+) -> Optional[List[MenuItem]]:
     system_prompt = (
         "You extract menu items and their ingredients from OCR text. "
         "Return JSON only with the schema: "
@@ -278,27 +993,18 @@ def call_sorux_for_menu_items(text: str) -> Optional[List[MenuItem]]:
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": text},
     ]
-    timeout = get_timeout_seconds("SORUXGPT_TEXT_TIMEOUT_SECONDS", 120.0)
-    content, error = call_sorux_chat(messages, model, timeout)
+    timeout = settings.text_timeout
+    content, error = call_sorux_routed(
+        messages, "text", text_features(text), timeout, has_menu_items, settings
+    )
     if error or not content:
         return None
-    json_block = extract_json_block(content)
-    if not json_block:
-        return None
-    try:
-        data = json.loads(json_block)
-        return parse_menu_items(data)
-    except Exception:
-        return None
+    return parse_menu_content(content)
 
 
 def call_sorux_image_caption(
-    image_bytes: bytes, mime_type: str
+    image_bytes: bytes, mime_type: str, settings: Settings
 ) -> Tuple[Optional[str], Optional[str]]:
-    model = get_env(
-        "SORUXGPT_IMAGE_MODEL",
-        get_env("SORUXGPT_TEXT_MODEL", "gpt-3.5-turbo")
-    )
     image_url = build_data_url(image_bytes, mime_type)
     messages = [
         {"role": "system", "content": IMAGE_CAPTION_PROMPT},
@@ -310,8 +1016,15 @@ def call_sorux_image_caption(
             ],
         },
     ]
-    timeout = get_timeout_seconds("SORUXGPT_IMAGE_TIMEOUT_SECONDS", 180.0)
-    content, error = call_sorux_chat(messages, model, timeout)
+    timeout = settings.image_timeout
+    content, error = call_sorux_routed(
+        messages,
+        "image",
+        {"bytes": len(image_bytes)},
+        timeout,
+        lambda text: not looks_like_missing_image(text),
+        settings
+    )
     if error or not content:
         return None, error or "SoruxGPT response missing content."
     if looks_like_missing_image(content):
@@ -319,31 +1032,23 @@ def call_sorux_image_caption(
     return content, None
 
 
-def call_sorux_text_to_json(caption: str) -> Optional[List[MenuItem]]:
-    model = get_env("SORUXGPT_TEXT_MODEL", "gpt-3.5-turbo")
+def call_sorux_text_to_json(
+    caption: str, settings: Settings
+) -> Optional[List[MenuItem]]:
     prompt = TEXT_TO_JSON_PROMPT.format(caption=caption)
     messages = [{"role": "user", "content": prompt}]
-    timeout = get_timeout_seconds("SORUXGPT_TEXT_TIMEOUT_SECONDS", 120.0)
-    content, error = call_sorux_chat(messages, model, timeout)
+    timeout = settings.text_timeout
+    content, error = call_sorux_routed(
+        messages, "text", text_features(caption), timeout, has_menu_items, settings
+    )
     if error or not content:
         return None
-    json_block = extract_json_block(content)
-    if not json_block:
-        return None
-    try:
-        parsed = json.loads(json_block)
-        return parse_menu_items(parsed)
-    except Exception:
-        return None
+    return parse_menu_content(content)
 
 
 def call_sorux_image_to_json(
-    image_bytes: bytes, mime_type: str, prompt: str
+    image_bytes: bytes, mime_type: str, prompt: str, settings: Settings
 ) -> Tuple[Optional[List[MenuItem]], Optional[str]]:
-    model = get_env(
-        "SORUXGPT_IMAGE_MODEL",
-        get_env("SORUXGPT_TEXT_MODEL", "gpt-3.5-turbo")
-    )
     image_url = build_data_url(image_bytes, mime_type)
     messages = [
         {"role": "system", "content": prompt},
@@ -355,8 +1060,10 @@ def call_sorux_image_to_json(
             ],
         },
     ]
-    timeout = get_timeout_seconds("SORUXGPT_IMAGE_TIMEOUT_SECONDS", 180.0)
-    content, error = call_sorux_chat(messages, model, timeout)
+    timeout = settings.image_timeout
+    content, error = call_sorux_routed(
+        messages, "image", {"bytes": len(image_bytes)}, timeout, has_menu_items, settings
+    )
     if error or not content:
         return None, error
     if looks_like_missing_image(content):
@@ -403,9 +1110,8 @@ def parse_analyze_response(data: object) -> Optional[AnalyzeResponse]:
 
 
 def call_sorux_text_analyze(
-    caption: str, preferences: Preferences
+    caption: str, preferences: Preferences, settings: Settings
 ) -> Optional[AnalyzeResponse]:
-    model = get_env("SORUXGPT_TEXT_MODEL", "gpt-3.5-turbo")
     allergies = ", ".join(preferences.allergies) or "none"
     dislikes = ", ".join(preferences.dislikes) or "none"
     goals = ", ".join(preferences.health_goals) or "none"
@@ -416,18 +1122,13 @@ def call_sorux_text_analyze(
         goals=goals
     )
     messages = [{"role": "user", "content": prompt}]
-    timeout = get_timeout_seconds("SORUXGPT_TEXT_TIMEOUT_SECONDS", 120.0)
-    content, error = call_sorux_chat(messages, model, timeout)
+    timeout = settings.text_timeout
+    content, error = call_sorux_routed(
+        messages, "text", text_features(caption), timeout, has_analysis, settings
+    )
     if error or not content:
         return None
-    json_block = extract_json_block(content)
-    if not json_block:
-        return None
-    try:
-        parsed = json.loads(json_block)
-    except Exception:
-        return None
-    return parse_analyze_response(parsed)
+    return parse_analyze_content(content)
 
 
 def preferences_from_json(raw: str) -> Preferences:
@@ -449,35 +1150,49 @@ def menu_items_to_text(items: List[MenuItem]) -> str:
     return " ".join(fragments)
 
 
-def collect_hits(
-    text: str, items: List[MenuItem], preferences: Preferences
-) -> List[RiskHit]:
+GOAL_KEYWORDS = {
+    "low_sugar": ["sugar", "syrup", "honey", "sweet", "糖", "甜"],
+    "low_salt": ["salt", "sodium", "soy", "酱油", "盐"],
+    "low_fat": ["oil", "fried", "cream", "butter", "油", "炸", "奶油"],
+}
+
+
+def build_haystack(text: str, items: List[MenuItem]) -> str:
     flat_text = normalize_text(text)
     flat_haystack = normalize_term(flat_text)
     for item in items:
         flat_haystack += normalize_term(item.name)
         flat_haystack += "".join(normalize_term(ing) for ing in item.ingredients)
-    hits: List[RiskHit] = []
-
-    for term in preferences.allergies:
-        needle = normalize_term(term)
-        if needle and needle in flat_haystack:
-            hits.append(RiskHit(term=term, reason="Allergy match", level="HIGH"))
-
-    for term in preferences.dislikes:
-        needle = normalize_term(term)
-        if needle and needle in flat_haystack:
-            hits.append(RiskHit(term=term, reason="Preference match", level="MEDIUM"))
-
-    goal_keywords = {
-        "low_sugar": ["sugar", "syrup", "honey", "sweet", "糖", "甜"],
-        "low_salt": ["salt", "sodium", "soy", "酱油", "盐"],
-        "low_fat": ["oil", "fried", "cream", "butter", "油", "炸", "奶油"],
-    }
-    for goal in preferences.health_goals:
-        key = normalize_term(goal)
-        for keyword in goal_keywords.get(key, []):
-            if normalize_term(keyword) in flat_haystack:
+    return flat_haystack
+
+
+def collect_hits_for_profiles(
+    text: str, items: List[MenuItem], profiles: List[Preferences]
+) -> List[List[RiskHit]]:
+    flat_haystack = build_haystack(text, items)
+    needles = set()
+    for preferences in profiles:
+        needles.update(normalize_term(term) for term in preferences.allergies)
+        needles.update(normalize_term(term) for term in preferences.dislikes)
+        for goal in preferences.health_goals:
+            keywords = GOAL_KEYWORDS.get(normalize_term(goal), [])
+            needles.update(normalize_term(keyword) for keyword in keywords)
+    matched = {needle for needle in needles if needle and needle in flat_haystack}
+
+    results: List[List[RiskHit]] = []
+    for preferences in profiles:
+        hits: List[RiskHit] = []
+        for term in preferences.allergies:
+            if normalize_term(term) in matched:
+                hits.append(RiskHit(term=term, reason="Allergy match", level="HIGH"))
+
+        for term in preferences.dislikes:
+            if normalize_term(term) in matched:
+                hits.append(RiskHit(term=term, reason="Preference match", level="MEDIUM"))
+
+        for goal in preferences.health_goals:
+            keywords = GOAL_KEYWORDS.get(normalize_term(goal), [])
+            if any(normalize_term(keyword) in matched for keyword in keywords):
                 hits.append(
                     RiskHit(
                         term=goal,
@@ -485,8 +1200,14 @@ def collect_hits(
                         level="LOW",
                     )
                 )
-                break
-    return hits
+        results.append(hits)
+    return results
+
+
+def collect_hits(
+    text: str, items: List[MenuItem], preferences: Preferences
+) -> List[RiskHit]:
+    return collect_hits_for_profiles(text, items, [preferences])[0]
 
 
 def pick_risk_level(hits: List[RiskHit]) -> str:
@@ -509,13 +1230,41 @@ def build_suggestions(hits: List[RiskHit]) -> List[str]:
     return suggestions
 
 
+def extract_menu_items(text: str, settings: Settings) -> List[MenuItem]:
+    local_items, confidence = parse_menu_locally(text)
+    if (
+        local_items
+        and confidence >= settings.menu_parser_threshold
+        and all(item.ingredients for item in local_items)
+    ):
+        METRICS.incr("menu_parse_local")
+        return local_items
+    METRICS.incr("menu_parse_llm")
+    menu_items = call_sorux_for_menu_items(text, settings)
+    if menu_items is None:
+        menu_items = local_items or naive_items_from_text(text)
+    return menu_items
+
+
+@app.get("/metrics")
+def metrics() -> dict:
+    counters = METRICS.snapshot()
+    local = counters.get("menu_parse_local", 0)
+    parsed = local + counters.get("menu_parse_llm", 0)
+    return {
+        "counters": counters,
+        "menu_parse_skip_rate": round(local / parsed, 3) if parsed else 0.0,
+        "latencies": METRICS.latency_snapshot(),
+    }
+
+
 @app.post("/analyze", response_model=AnalyzeResponse)
-def analyze(request: AnalyzeRequest) -> AnalyzeResponse:
+def analyze(
+    request: AnalyzeRequest, settings: Settings = Depends(get_settings)
+) -> AnalyzeResponse:
     if not request.text.strip():
         raise HTTPException(status_code=400, detail="OCR text is empty.")
-    menu_items = call_sorux_for_menu_items(request.text)
-    if menu_items is None:
-        menu_items = naive_items_from_text(request.text)
+    menu_items = extract_menu_items(request.text, settings)
     preferences = request.preferences or Preferences()
     hits = collect_hits(request.text, menu_items, preferences)
     risk_level = pick_risk_level(hits)
@@ -528,62 +1277,400 @@ def analyze(request: AnalyzeRequest) -> AnalyzeResponse:
     )
 
 
-@app.post("/analyze-image", response_model=AnalyzeResponse)
-async def analyze_image(
-    image: UploadFile = File(...),
-    preferences: str = Form("")
-) -> AnalyzeResponse:
-    if not image.content_type or not image.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="Invalid image type.")
-    image_bytes = await image.read()
-    if not image_bytes:
-        raise HTTPException(status_code=400, detail="Image data is empty.")
-    prefs = preferences_from_json(preferences)
-    sorux_key = get_env("SORUXGPT_API_KEY")
-    if not sorux_key:
-        raise HTTPException(
-            status_code=501,
-            detail="SORUXGPT_API_KEY is not set."
-        )
-
-    caption = None
-    sorux_error = None
-    caption, sorux_error = call_sorux_image_caption(
-        image_bytes,
-        image.content_type or "application/octet-stream"
+@app.post("/analyze-group", response_model=GroupAnalyzeResponse)
+def analyze_group(
+    request: GroupAnalyzeRequest, settings: Settings = Depends(get_settings)
+) -> GroupAnalyzeResponse:
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="OCR text is empty.")
+    if not request.profiles:
+        raise HTTPException(status_code=400, detail="No preference profiles given.")
+    menu_items = extract_menu_items(request.text, settings)
+    profile_hits = collect_hits_for_profiles(
+        request.text, menu_items, request.profiles
+    )
+    return GroupAnalyzeResponse(
+        menu_items=menu_items,
+        profiles=[
+            ProfileAnalysis(
+                risk_level=pick_risk_level(hits),
+                hits=hits,
+                suggestions=build_suggestions(hits),
+            )
+            for hits in profile_hits
+        ],
     )
 
-    if caption:
-        analysis = call_sorux_text_analyze(caption, prefs)
+
+def analyze_one_image(
+    image_bytes: bytes,
+    mime_type: str,
+    preferences: Optional[Preferences],
+    settings: Settings
+) -> Tuple[Optional[AnalyzeResponse], Optional[List[MenuItem]], Optional[str]]:
+    caption, sorux_error = call_sorux_image_caption(image_bytes, mime_type, settings)
+
+    if caption and preferences is not None:
+        analysis = call_sorux_text_analyze(caption, preferences, settings)
         if analysis:
-            return analysis
+            return analysis, analysis.menu_items, None
 
     menu_items = None
     if caption:
-        menu_items = call_sorux_text_to_json(caption)
+        menu_items = call_sorux_text_to_json(caption, settings)
         if menu_items is None:
             menu_items = naive_items_from_text(caption)
     if menu_items is None:
         menu_items, sorux_error = call_sorux_image_to_json(
             image_bytes=image_bytes,
-            mime_type=image.content_type,
-            prompt=DEFAULT_IMAGE_PROMPT
+            mime_type=mime_type,
+            prompt=DEFAULT_IMAGE_PROMPT,
+            settings=settings
         )
-    if menu_items is None:
+    return None, menu_items, sorux_error
+
+
+def merge_menu_items(groups: List[List[MenuItem]]) -> List[MenuItem]:
+    merged: Dict[str, MenuItem] = {}
+    for items in groups:
+        for item in items:
+            key = normalize_term(item.name)
+            if not key:
+                continue
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = MenuItem(name=item.name, ingredients=list(item.ingredients))
+                continue
+            seen = {normalize_term(ing) for ing in existing.ingredients}
+            for ingredient in item.ingredients:
+                if normalize_term(ingredient) not in seen:
+                    seen.add(normalize_term(ingredient))
+                    existing.ingredients.append(ingredient)
+    return list(merged.values())
+
+
+async def read_image_uploads(
+    image: List[UploadFile], settings: Settings
+) -> List[Tuple[bytes, str]]:
+    max_files = settings.analyze_image_max_files
+    if len(image) > max_files:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many images; at most {max_files} per request."
+        )
+    uploads = []
+    for upload in image:
+        if not upload.content_type or not upload.content_type.startswith("image/"):
+            raise HTTPException(status_code=400, detail="Invalid image type.")
+        image_bytes = await upload.read()
+        if not image_bytes:
+            raise HTTPException(status_code=400, detail="Image data is empty.")
+        uploads.append((image_bytes, upload.content_type))
+    if not settings.api_key:
+        raise HTTPException(
+            status_code=501,
+            detail="SORUXGPT_API_KEY is not set."
+        )
+    return uploads
+
+
+def combine_image_results(
+    results: List[Tuple[Optional[AnalyzeResponse], Optional[List[MenuItem]], Optional[str]]],
+    prefs: Preferences
+) -> AnalyzeResponse:
+    if len(results) == 1 and results[0][0]:
+        return results[0][0]
+
+    groups = [menu_items for _, menu_items, _ in results if menu_items is not None]
+    if not groups:
         detail = "Image analysis failed."
-        if sorux_error:
-            detail = f"{detail} SoruxGPT error: {sorux_error}"
+        errors = [error for _, _, error in results if error]
+        if errors:
+            detail = f"{detail} SoruxGPT error: {'; '.join(dict.fromkeys(errors))}"
         raise HTTPException(
             status_code=502,
             detail=detail
         )
+    failed_images = len(results) - len(groups)
+    menu_items = merge_menu_items(groups)
     text_for_hits = menu_items_to_text(menu_items)
     hits = collect_hits(text_for_hits, menu_items, prefs)
     risk_level = pick_risk_level(hits)
     suggestions = build_suggestions(hits)
+    if failed_images:
+        suggestions.insert(
+            0,
+            f"{failed_images} of {len(results)} images could not be analyzed; "
+            "dishes on those images are not included. Retake or resend them."
+        )
     return AnalyzeResponse(
         menu_items=menu_items,
         risk_level=risk_level,
         hits=hits,
         suggestions=suggestions,
+        failed_images=failed_images,
+    )
+
+
+async def analyze_uploads(
+    uploads: List[Tuple[bytes, str]], prefs: Preferences, settings: Settings
+) -> AnalyzeResponse:
+    single = len(uploads) == 1
+    limiter = anyio.CapacityLimiter(settings.analyze_image_concurrency)
+    results = await asyncio.gather(
+        *(
+            anyio.to_thread.run_sync(
+                analyze_one_image,
+                image_bytes,
+                mime_type,
+                prefs if single else None,
+                settings,
+                limiter=limiter
+            )
+            for image_bytes, mime_type in uploads
+        )
     )
+    return combine_image_results(results, prefs)
+
+
+def analyze_uploads_sync(
+    uploads: List[Tuple[bytes, str]], prefs: Preferences, settings: Settings
+) -> AnalyzeResponse:
+    single = len(uploads) == 1
+    workers = min(settings.analyze_image_concurrency, len(uploads))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analyze-image") as pool:
+        results = list(
+            pool.map(
+                lambda upload: analyze_one_image(
+                    upload[0], upload[1], prefs if single else None, settings
+                ),
+                uploads
+            )
+        )
+    return combine_image_results(results, prefs)
+
+
+@app.post("/analyze-image", response_model=AnalyzeResponse)
+async def analyze_image(
+    image: List[UploadFile] = File(...),
+    preferences: str = Form(""),
+    settings: Settings = Depends(get_settings)
+) -> AnalyzeResponse:
+    uploads = await read_image_uploads(image, settings)
+    prefs = preferences_from_json(preferences)
+    return await analyze_uploads(uploads, prefs, settings)
+
+
+def resolve_callback_url(
+    url: str, settings: Settings
+) -> Tuple[Optional[str], Optional[str]]:
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return None, "Invalid callback URL."
+    host = parts.hostname.lower()
+    if settings.job_callback_allowed_hosts:
+        if host in settings.job_callback_allowed_hosts:
+            return None, None
+        return None, "Callback host is not allowed."
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (OSError, ValueError):
+        return None, "Callback host could not be resolved."
+    addresses = [str(info[4][0]).split("%", 1)[0] for info in infos]
+    for address in addresses:
+        if not ipaddress.ip_address(address).is_global:
+            return None, "Callback URL must resolve to a public address."
+    return addresses[0], None
+
+
+def callback_url_error(url: str, settings: Settings) -> Optional[str]:
+    return resolve_callback_url(url, settings)[1]
+
+
+def send_callback(url: str, job: "Job", settings: Settings) -> None:
+    address, error = resolve_callback_url(url, settings)
+    if error:
+        return
+    parts = urlsplit(url)
+    headers: Dict[str, str] = {}
+    extensions: Dict[str, str] = {}
+    if address is not None:
+        # Connect to the address that was checked so a second DNS lookup
+        # cannot point the request somewhere else.
+        host = f"[{address}]" if ":" in address else address
+        port = f":{parts.port}" if parts.port else ""
+        url = parts._replace(netloc=f"{host}{port}").geturl()
+        headers["Host"] = f"{parts.hostname}{port}"
+        extensions["sni_hostname"] = parts.hostname
+    try:
+        with httpx.Client(timeout=10.0, follow_redirects=False) as client:
+            client.post(
+                url,
+                json=job.to_response().model_dump(),
+                headers=headers,
+                extensions=extensions
+            )
+    except Exception:
+        pass
+
+
+class Job:
+    def __init__(
+        self, job_id: str, key: str, callback_url: str, loop: asyncio.AbstractEventLoop
+    ) -> None:
+        self.job_id = job_id
+        self.key = key
+        self.callback_urls = [callback_url] if callback_url else []
+        self.loop = loop
+        self.status = "queued"
+        self.result: Optional[AnalyzeResponse] = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.done = asyncio.Event()
+
+    def to_response(self) -> JobResponse:
+        return JobResponse(
+            job_id=self.job_id,
+            status=self.status,
+            result=self.result,
+            error=self.error,
+        )
+
+
+class JobStore:
+    def __init__(self, workers: int) -> None:
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, Job] = {}
+        self.by_key: Dict[str, str] = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="analyze-job",
+        )
+        # Slow callback receivers must not hold analysis workers.
+        self.callback_executor = ThreadPoolExecutor(
+            max_workers=4,
+            thread_name_prefix="job-callback",
+        )
+
+    def purge_expired(self, settings: Settings) -> None:
+        ttl = settings.job_ttl_seconds
+        now = time.time()
+        with self.lock:
+            expired = [
+                job
+                for job in self.jobs.values()
+                if job.finished is not None and now - job.finished > ttl
+            ]
+            for job in expired:
+                del self.jobs[job.job_id]
+                if self.by_key.get(job.key) == job.job_id:
+                    del self.by_key[job.key]
+
+    def get(self, job_id: str, settings: Settings) -> Optional[Job]:
+        self.purge_expired(settings)
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def submit(
+        self,
+        key: str,
+        callback_url: str,
+        uploads: List[Tuple[bytes, str]],
+        prefs: Preferences,
+        settings: Settings
+    ) -> Job:
+        self.purge_expired(settings)
+        with self.lock:
+            existing_id = self.by_key.get(key)
+            existing = self.jobs.get(existing_id) if existing_id else None
+            if existing is not None and existing.status != "failed":
+                if callback_url and callback_url not in existing.callback_urls:
+                    existing.callback_urls.append(callback_url)
+                    if existing.finished is not None:
+                        self.callback_executor.submit(
+                            send_callback, callback_url, existing, settings
+                        )
+                return existing
+            pending = sum(
+                1 for job in self.jobs.values() if job.status in ("queued", "running")
+            )
+            if pending >= settings.job_max_pending:
+                raise HTTPException(status_code=503, detail="Job queue is full.")
+            job = Job(uuid.uuid4().hex, key, callback_url, asyncio.get_running_loop())
+            self.jobs[job.job_id] = job
+            self.by_key[key] = job.job_id
+        self.executor.submit(self.run, job, uploads, prefs, settings)
+        return job
+
+    def run(
+        self,
+        job: Job,
+        uploads: List[Tuple[bytes, str]],
+        prefs: Preferences,
+        settings: Settings
+    ) -> None:
+        job.status = "running"
+        try:
+            result = analyze_uploads_sync(uploads, prefs, settings)
+            status, error = "done", None
+        except HTTPException as exc:
+            result, status, error = None, "failed", str(exc.detail)
+        except Exception as exc:
+            result, status, error = None, "failed", str(exc) or "Image analysis failed."
+        with self.lock:
+            job.result, job.status, job.error = result, status, error
+            job.finished = time.time()
+            callback_urls = list(job.callback_urls)
+        try:
+            job.loop.call_soon_threadsafe(job.done.set)
+        except RuntimeError:
+            pass
+        for url in callback_urls:
+            self.callback_executor.submit(send_callback, url, job, settings)
+
+
+JOBS = JobStore(SETTINGS.current.job_workers)
+
+
+def job_key(uploads: List[Tuple[bytes, str]], prefs: Preferences) -> str:
+    digest = hashlib.sha256()
+    for image_bytes, mime_type in uploads:
+        digest.update(mime_type.encode("utf-8"))
+        digest.update(hashlib.sha256(image_bytes).digest())
+    digest.update(json.dumps(prefs.model_dump(), sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+@app.post("/jobs/analyze-image", response_model=JobResponse, status_code=202)
+async def submit_image_job(
+    image: List[UploadFile] = File(...),
+    preferences: str = Form(""),
+    callback_url: str = Form(""),
+    settings: Settings = Depends(get_settings)
+) -> JobResponse:
+    uploads = await read_image_uploads(image, settings)
+    prefs = preferences_from_json(preferences)
+    if callback_url:
+        error = await anyio.to_thread.run_sync(callback_url_error, callback_url, settings)
+        if error:
+            raise HTTPException(status_code=400, detail=error)
+    job = JOBS.submit(job_key(uploads, prefs), callback_url, uploads, prefs, settings)
+    return job.to_response()
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: str, wait: float = 0.0, settings: Settings = Depends(get_settings)
+) -> JobResponse:
+    job = JOBS.get(job_id, settings)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+    wait = min(max(wait, 0.0), settings.job_max_wait_seconds)
+    if wait and not job.done.is_set():
+        try:
+            await asyncio.wait_for(job.done.wait(), timeout=wait)
+        except asyncio.TimeoutError:
+            pass
+    return job.to_response()
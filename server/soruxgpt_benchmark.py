@@ -0,0 +1,428 @@
+import argparse
+import csv
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+
+from soruxgpt_smoke_test import (
+    IMAGE_CAPTION_PROMPT,
+    TEXT_TO_JSON_PROMPT,
+    build_data_url,
+    can_resize,
+    get_env,
+    resize_image,
+    sorux_base_url,
+    source_mime_type,
+)
+
+STUB_CAPTION = "A bowl of noodles with peanuts, scallions and soy sauce."
+STUB_MENU_JSON = (
+    '{"menu_items":[{"name":"Peanut Noodles",'
+    '"ingredients":["noodles","peanut","scallion","soy sauce"]}]}'
+)
+REPORT_FIELDS = [
+    "image_model",
+    "text_model",
+    "max_size",
+    "quality",
+    "runs",
+    "errors",
+    "json_success_rate",
+    "caption_p50_ms",
+    "caption_p90_ms",
+    "caption_p99_ms",
+    "text_p50_ms",
+    "text_p90_ms",
+    "text_p99_ms",
+    "total_p50_ms",
+    "total_p90_ms",
+    "total_p99_ms",
+    "image_bytes_avg",
+    "request_bytes_avg",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+]
+
+
+def split_list(raw: str) -> list[str]:
+    return [item.strip() for item in raw.split(",") if item.strip()]
+
+
+def find_images(patterns: list[str]) -> list[str]:
+    if patterns:
+        return patterns
+    photos_dir = Path(__file__).resolve().parents[1] / "photos"
+    images = []
+    for suffix in ("*.png", "*.PNG", "*.jpg", "*.jpeg", "*.JPG", "*.JPEG"):
+        images.extend(str(path) for path in sorted(photos_dir.glob(suffix)))
+    return images
+
+
+def extract_json_block(text: str) -> str | None:
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end == -1 or end <= start:
+        return None
+    return text[start : end + 1]
+
+
+def menu_json_ok(content: str | None) -> bool:
+    if not content:
+        return False
+    block = extract_json_block(content)
+    if not block:
+        return False
+    try:
+        data = json.loads(block)
+    except Exception:
+        return False
+    items = data.get("menu_items") if isinstance(data, dict) else None
+    return isinstance(items, list) and any(
+        isinstance(item, dict) and str(item.get("name", "")).strip()
+        for item in items
+    )
+
+
+def timed_chat(
+    client: httpx.Client,
+    base_url: str,
+    api_key: str,
+    messages: list[dict],
+    model: str
+) -> dict:
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": 0.2}
+    ).encode("utf-8")
+    result = {
+        "content": None,
+        "error": None,
+        "latency_ms": 0.0,
+        "request_bytes": len(payload),
+        "usage": {},
+    }
+    start = time.perf_counter()
+    try:
+        response = client.post(
+            f"{base_url}/chat/completions",
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+            },
+            content=payload
+        )
+    except httpx.TimeoutException:
+        result["error"] = "timeout"
+        result["latency_ms"] = (time.perf_counter() - start) * 1000
+        return result
+    except Exception as exc:
+        result["error"] = str(exc)
+        result["latency_ms"] = (time.perf_counter() - start) * 1000
+        return result
+    result["latency_ms"] = (time.perf_counter() - start) * 1000
+    try:
+        data = response.json()
+    except Exception:
+        data = None
+    if response.status_code >= 400:
+        result["error"] = f"SoruxGPT {response.status_code}"
+        return result
+    if isinstance(data, dict):
+        usage = data.get("usage")
+        if isinstance(usage, dict):
+            result["usage"] = usage
+        choices = data.get("choices")
+        if isinstance(choices, list) and choices:
+            content = choices[0].get("message", {}).get("content")
+            if isinstance(content, str) and content.strip():
+                result["content"] = content.strip()
+                return result
+    result["error"] = "SoruxGPT response missing content."
+    return result
+
+
+def run_once(
+    client: httpx.Client,
+    base_url: str,
+    api_key: str,
+    image_model: str,
+    text_model: str,
+    image_bytes: bytes,
+    mime_type: str
+) -> dict:
+    image_url = build_data_url(image_bytes, mime_type)
+    caption_messages = [
+        {"role": "system", "content": IMAGE_CAPTION_PROMPT},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "Describe the food image."},
+                {"type": "image_url", "image_url": {"url": image_url}},
+            ],
+        },
+    ]
+    caption = timed_chat(client, base_url, api_key, caption_messages, image_model)
+    run = {
+        "caption_ms": caption["latency_ms"],
+        "text_ms": None,
+        "image_bytes": len(image_bytes),
+        "request_bytes": caption["request_bytes"],
+        "usage": [caption["usage"]],
+        "error": caption["error"],
+        "json_ok": False,
+    }
+    if caption["error"]:
+        return run
+    prompt = TEXT_TO_JSON_PROMPT.format(caption=caption["content"])
+    text = timed_chat(
+        client, base_url, api_key, [{"role": "user", "content": prompt}], text_model
+    )
+    run["text_ms"] = text["latency_ms"]
+    run["request_bytes"] += text["request_bytes"]
+    run["usage"].append(text["usage"])
+    run["error"] = text["error"]
+    run["json_ok"] = menu_json_ok(text["content"])
+    return run
+
+
+def percentile(values: list[float], pct: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return round(ordered[rank], 1)
+
+
+def summarize(combo: dict, runs: list[dict]) -> dict:
+    captions = [run["caption_ms"] for run in runs]
+    texts = [run["text_ms"] for run in runs if run["text_ms"] is not None]
+    totals = [
+        run["caption_ms"] + run["text_ms"]
+        for run in runs
+        if run["text_ms"] is not None
+    ]
+    tokens = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    for run in runs:
+        for usage in run["usage"]:
+            for key in tokens:
+                value = usage.get(key)
+                if isinstance(value, int):
+                    tokens[key] += value
+    row = dict(combo)
+    row.update(
+        {
+            "runs": len(runs),
+            "errors": sum(1 for run in runs if run["error"]),
+            "json_success_rate": round(
+                sum(1 for run in runs if run["json_ok"]) / len(runs), 3
+            ) if runs else 0.0,
+            "image_bytes_avg": round(
+                sum(run["image_bytes"] for run in runs) / len(runs)
+            ) if runs else 0,
+            "request_bytes_avg": round(
+                sum(run["request_bytes"] for run in runs) / len(runs)
+            ) if runs else 0,
+        }
+    )
+    for prefix, values in (("caption", captions), ("text", texts), ("total", totals)):
+        for pct in (50, 90, 99):
+            row[f"{prefix}_p{pct}_ms"] = percentile(values, pct)
+    row.update(tokens)
+    return row
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length))
+        except Exception:
+            payload = {}
+        messages = payload.get("messages", [])
+        has_image = "image_url" in json.dumps(messages)
+        time.sleep(self.latency)
+        content = STUB_CAPTION if has_image else STUB_MENU_JSON
+        prompt_tokens = length // 4
+        completion_tokens = len(content) // 4
+        body = json.dumps(
+            {
+                "model": payload.get("model"),
+                "choices": [{"message": {"role": "assistant", "content": content}}],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+def start_stub(latency: float) -> tuple[ThreadingHTTPServer, str]:
+    handler = type("Handler", (StubHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1"
+
+
+def write_report(rows: list[dict], output: str) -> None:
+    path = Path(output)
+    if path.suffix.lower() == ".csv":
+        with path.open("w", newline="", encoding="utf-8") as handle:
+            writer = csv.DictWriter(handle, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        path.write_text(json.dumps(rows, indent=2), encoding="utf-8")
+    print(f"Report written to {path}")
+
+
+def prepare_benchmark_image(image_path: str, max_size: int, quality: int) -> tuple[bytes, str]:
+    source = Path(image_path)
+    if max_size <= 0 or quality <= 0:
+        return source.read_bytes(), source_mime_type(source)
+    resized = resize_image(image_path, max_size, quality)
+    if resized is None:
+        raise SystemExit(f"Could not resize {image_path} to size={max_size} q={quality}.")
+    return resized
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark SoruxGPT models and image settings over photos/."
+    )
+    parser.add_argument(
+        "--images",
+        nargs="*",
+        default=[],
+        help="Image files to use. Defaults to everything under photos/."
+    )
+    parser.add_argument(
+        "--image-models",
+        default=get_env("SORUXGPT_IMAGE_MODEL", "gpt-4o-mini"),
+        help="Comma-separated image models to sweep."
+    )
+    parser.add_argument(
+        "--text-models",
+        default=get_env("SORUXGPT_TEXT_MODEL", "gpt-3.5-turbo"),
+        help="Comma-separated text models to sweep."
+    )
+    parser.add_argument(
+        "--sizes",
+        default="640",
+        help="Comma-separated max image edges. 0 sends the original bytes."
+    )
+    parser.add_argument("--qualities", default="70", help="Comma-separated JPEG qualities.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per image per combination.")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=180.0)
+    parser.add_argument("--base-url", default=None, help="Overrides SORUXGPT_BASE_URL.")
+    parser.add_argument(
+        "--stub",
+        action="store_true",
+        help="Run against a built-in local stub endpoint instead of SoruxGPT."
+    )
+    parser.add_argument(
+        "--stub-latency",
+        type=float,
+        default=0.2,
+        help="Seconds the stub waits before replying."
+    )
+    parser.add_argument("--output", help="Write the report to a .csv or .json file.")
+    args = parser.parse_args()
+
+    images = find_images(args.images)
+    if not images:
+        raise SystemExit("No images found under photos/. Provide --images.")
+    stub = None
+    api_key = get_env("SORUXGPT_API_KEY")
+    if args.stub:
+        stub, base_url = start_stub(args.stub_latency)
+        api_key = api_key or "stub"
+    else:
+        base_url = (args.base_url or sorux_base_url()).rstrip("/")
+        if not api_key:
+            raise SystemExit("SORUXGPT_API_KEY is not set. Use --stub to run locally.")
+
+    combos = [
+        {
+            "image_model": image_model,
+            "text_model": text_model,
+            "max_size": int(size),
+            "quality": int(quality),
+        }
+        for image_model, text_model, size, quality in itertools.product(
+            split_list(args.image_models),
+            split_list(args.text_models),
+            split_list(args.sizes),
+            split_list(args.qualities),
+        )
+    ]
+    if any(combo["max_size"] > 0 and combo["quality"] > 0 for combo in combos) and not can_resize():
+        raise SystemExit(
+            "Resizing needs Pillow (pip install pillow) or macOS sips. "
+            "Use --sizes 0 to benchmark original images only."
+        )
+    print(f"Benchmarking {len(combos)} combinations over {len(images)} images at {base_url}")
+    prepared: dict[tuple[str, int, int], tuple[bytes, str]] = {}
+    rows = []
+    timeout_config = httpx.Timeout(args.timeout, connect=10.0)
+    limits = httpx.Limits(max_connections=max(1, args.concurrency))
+    with httpx.Client(timeout=timeout_config, limits=limits) as client:
+        for combo in combos:
+            tasks = []
+            for image_path in images:
+                key = (image_path, combo["max_size"], combo["quality"])
+                if key not in prepared:
+                    prepared[key] = prepare_benchmark_image(
+                        image_path, combo["max_size"], combo["quality"]
+                    )
+                tasks.extend([prepared[key]] * max(1, args.repeat))
+            with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+                runs = list(
+                    pool.map(
+                        lambda task: run_once(
+                            client,
+                            base_url,
+                            api_key,
+                            combo["image_model"],
+                            combo["text_model"],
+                            task[0],
+                            task[1]
+                        ),
+                        tasks
+                    )
+                )
+            row = summarize(combo, runs)
+            rows.append(row)
+            print(
+                f"{row['image_model']} + {row['text_model']} "
+                f"size={row['max_size']} q={row['quality']}: "
+                f"total p50={row['total_p50_ms']}ms p90={row['total_p90_ms']}ms "
+                f"json={row['json_success_rate']:.0%} errors={row['errors']} "
+                f"bytes={row['image_bytes_avg']} tokens={row['total_tokens']}"
+            )
+    if stub:
+        stub.shutdown()
+    if args.output:
+        write_report(rows, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import argparse
 import base64
+import io
 import json
+import mimetypes
 import os
 import shutil
 import subprocess
@@ -21,6 +23,11 @@ try:
 except Exception:
     pass
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 
 IMAGE_CAPTION_PROMPT = (
     "Describe the dishes and ingredients in the food image. "
@@ -108,17 +115,36 @@ def call_sorux_chat(
     return None, "SoruxGPT response missing content."
 
 
-def prepare_image_bytes(
-    image_path: str,
+def source_mime_type(source: Path) -> str:
+    mime_type, _ = mimetypes.guess_type(source.name)
+    return mime_type or "image/png"
+
+
+def can_resize() -> bool:
+    return Image is not None or shutil.which("sips") is not None
+
+
+def resize_with_pillow(
+    source: Path,
     max_size: int,
     quality: int
-) -> tuple[bytes, str]:
-    source = Path(image_path)
-    if max_size <= 0 or quality <= 0:
-        return source.read_bytes(), "image/png"
-    if not shutil.which("sips"):
-        print("warning: sips not found; using original image bytes.")
-        return source.read_bytes(), "image/png"
+) -> tuple[bytes, str] | None:
+    try:
+        with Image.open(source) as image:
+            image = image.convert("RGB")
+            image.thumbnail((max_size, max_size))
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=quality)
+    except Exception:
+        return None
+    return buffer.getvalue(), "image/jpeg"
+
+
+def resize_with_sips(
+    source: Path,
+    max_size: int,
+    quality: int
+) -> tuple[bytes, str] | None:
     with tempfile.TemporaryDirectory() as temp_dir:
         output_path = Path(temp_dir) / "upload.jpg"
         cmd = [
@@ -141,10 +167,41 @@ def prepare_image_bytes(
             stderr=subprocess.DEVNULL
         )
         if result.returncode != 0 or not output_path.exists():
-            return source.read_bytes(), "image/png"
+            return None
         return output_path.read_bytes(), "image/jpeg"
 
 
+def resize_image(
+    image_path: str,
+    max_size: int,
+    quality: int
+) -> tuple[bytes, str] | None:
+    source = Path(image_path)
+    if Image is not None:
+        return resize_with_pillow(source, max_size, quality)
+    if shutil.which("sips"):
+        return resize_with_sips(source, max_size, quality)
+    return None
+
+
+def prepare_image_bytes(
+    image_path: str,
+    max_size: int,
+    quality: int
+) -> tuple[bytes, str]:
+    source = Path(image_path)
+    if max_size <= 0 or quality <= 0:
+        return source.read_bytes(), source_mime_type(source)
+    if not can_resize():
+        print("warning: Pillow and sips not found; using original image bytes.")
+        return source.read_bytes(), source_mime_type(source)
+    resized = resize_image(image_path, max_size, quality)
+    if resized is None:
+        print(f"warning: could not resize {source}; using original image bytes.")
+        return source.read_bytes(), source_mime_type(source)
+    return resized
+
+
 def run_image_caption(
     image_path: str,
     model: str,
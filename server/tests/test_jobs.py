@@ -0,0 +1,172 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from main import AnalyzeResponse, JobStore, MenuItem, Settings, callback_url_error
+
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"0" * 32
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    settings = Settings(api_key="key", job_ttl_seconds=3600.0)
+    store = JobStore(2)
+    monkeypatch.setattr(main, "JOBS", store)
+    state = {"settings": settings, "calls": 0, "fail": False, "gate": None}
+
+    def fake_analyze_one_image(image_bytes, mime_type, preferences, settings):
+        state["calls"] += 1
+        if state["gate"] is not None:
+            state["gate"].wait(5)
+        if state["fail"]:
+            return None, None, "upstream down"
+        analysis = AnalyzeResponse(
+            menu_items=[MenuItem(name="Peanut Noodles", ingredients=["peanut"])],
+            risk_level="LOW",
+            hits=[],
+            suggestions=[],
+        )
+        return analysis, analysis.menu_items, None
+
+    monkeypatch.setattr(main, "analyze_one_image", fake_analyze_one_image)
+    main.app.dependency_overrides[main.get_settings] = lambda: state["settings"]
+    with TestClient(main.app) as client:
+        yield client, state
+    main.app.dependency_overrides.clear()
+    store.executor.shutdown(wait=True)
+    store.callback_executor.shutdown(wait=True)
+
+
+def submit(client, image=PNG, preferences=""):
+    return client.post(
+        "/jobs/analyze-image",
+        files={"image": ("menu.png", image, "image/png")},
+        data={"preferences": preferences},
+    )
+
+
+def test_submit_returns_job_and_long_poll_waits_for_result(jobs):
+    client, state = jobs
+    state["gate"] = threading.Event()
+    response = submit(client)
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert response.json()["status"] in ("queued", "running")
+
+    started = time.perf_counter()
+    pending = client.get(f"/jobs/{job_id}?wait=0.2").json()
+    assert pending["status"] in ("queued", "running")
+    assert time.perf_counter() - started >= 0.2
+
+    state["gate"].set()
+    done = client.get(f"/jobs/{job_id}?wait=5").json()
+    assert done["status"] == "done"
+    assert done["result"]["menu_items"][0]["name"] == "Peanut Noodles"
+
+
+def test_identical_submission_returns_existing_job(jobs):
+    client, state = jobs
+    first = submit(client).json()["job_id"]
+    assert submit(client).json()["job_id"] == first
+    client.get(f"/jobs/{first}?wait=5")
+    assert submit(client).json()["job_id"] == first
+    assert state["calls"] == 1
+    other = submit(client, preferences='{"allergies": ["peanut"]}').json()["job_id"]
+    assert other != first
+
+
+def test_failed_job_is_run_again(jobs):
+    client, state = jobs
+    state["fail"] = True
+    first = submit(client).json()["job_id"]
+    failed = client.get(f"/jobs/{first}?wait=5").json()
+    assert failed["status"] == "failed"
+    assert "upstream down" in failed["error"]
+
+    state["fail"] = False
+    second = submit(client).json()["job_id"]
+    assert second != first
+    assert client.get(f"/jobs/{second}?wait=5").json()["status"] == "done"
+
+
+def test_finished_jobs_expire_after_ttl(jobs):
+    client, state = jobs
+    state["settings"] = Settings(api_key="key", job_ttl_seconds=0.05)
+    job_id = submit(client).json()["job_id"]
+    assert client.get(f"/jobs/{job_id}?wait=5").json()["status"] == "done"
+    time.sleep(0.1)
+    assert client.get(f"/jobs/{job_id}").status_code == 404
+    assert client.get("/jobs/unknown").status_code == 404
+
+
+def test_job_images_are_analyzed_concurrently(jobs):
+    client, state = jobs
+    state["gate"] = threading.Barrier(2)
+    files = [
+        ("image", ("a.png", PNG, "image/png")),
+        ("image", ("b.png", PNG + b"1", "image/png")),
+    ]
+    job_id = client.post("/jobs/analyze-image", files=files).json()["job_id"]
+    job = client.get(f"/jobs/{job_id}?wait=5").json()
+    assert job["status"] == "done"
+    assert job["result"]["failed_images"] == 0
+
+
+def test_callback_rejects_internal_addresses():
+    settings = Settings()
+    for url in (
+        "http://127.0.0.1:8000/cb",
+        "http://localhost/cb",
+        "http://10.0.0.5/cb",
+        "http://192.168.1.2/cb",
+        "http://169.254.169.254/latest/meta-data",
+        "http://[::1]/cb",
+        "http://[::ffff:127.0.0.1]/cb",
+    ):
+        assert callback_url_error(url, settings), url
+
+
+def test_callback_requires_http_url():
+    settings = Settings()
+    assert callback_url_error("ftp://8.8.8.8/cb", settings)
+    assert callback_url_error("http:///cb", settings)
+
+
+def test_callback_public_address_and_allowlist():
+    assert callback_url_error("https://8.8.8.8/cb", Settings()) is None
+    settings = Settings(job_callback_allowed_hosts=("hooks.internal",))
+    assert callback_url_error("http://hooks.internal/cb", settings) is None
+    assert callback_url_error("https://8.8.8.8/cb", settings)
+
+
+def test_callback_connects_to_checked_address(monkeypatch):
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            received.append((self.headers["Host"], self.path))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    monkeypatch.setattr(
+        main, "resolve_callback_url", lambda url, settings: ("127.0.0.1", None)
+    )
+    job = main.Job("job", "key", "", None)
+    try:
+        main.send_callback(f"http://hooks.example.com:{port}/done", job, Settings())
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert received == [(f"hooks.example.com:{port}", "/done")]
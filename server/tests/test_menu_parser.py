@@ -0,0 +1,131 @@
+import main
+from main import Settings, extract_menu_items, parse_menu_locally
+
+
+def names(items):
+    return [item.name for item in items]
+
+
+def test_name_ingredient_lines_with_prices_and_headers():
+    text = (
+        "APPETIZERS\n"
+        "1. Edamame (soybean, salt)  4.00\n"
+        "MAINS:\n"
+        "Kung Pao Chicken: chicken, peanut, chili - $14\n"
+        "Beef Noodle Soup - beef, noodles, scallion   $13.5\n"
+    )
+    items, confidence = parse_menu_locally(text)
+    assert names(items) == ["Edamame", "Kung Pao Chicken", "Beef Noodle Soup"]
+    assert items[1].ingredients == ["chicken", "peanut", "chili"]
+    assert items[2].ingredients == ["beef", "noodles", "scallion"]
+    assert confidence == 1.0
+
+
+def test_chinese_separators_and_bilingual_pairs():
+    text = (
+        "【热菜】\n"
+        "宫保鸡丁\n"
+        "Kung Pao Chicken\n"
+        "￥38\n"
+        "鱼香肉丝：猪肉、木耳、胡萝卜  32元\n"
+        "拍黄瓜 12\n"
+    )
+    items, _ = parse_menu_locally(text)
+    assert names(items) == ["宫保鸡丁 Kung Pao Chicken", "鱼香肉丝", "拍黄瓜"]
+    assert items[1].ingredients == ["猪肉", "木耳", "胡萝卜"]
+
+
+def test_priced_names_without_ingredients_are_not_confident():
+    items, confidence = parse_menu_locally("Kung Pao Chicken $12\nPad Thai $10")
+    assert names(items) == ["Kung Pao Chicken", "Pad Thai"]
+    assert all(not item.ingredients for item in items)
+    assert confidence < 0.8
+
+
+def test_prose_is_treated_as_noise():
+    text = (
+        "Welcome to our restaurant! We are open daily from 10am.\n"
+        "Please ask staff about allergens.\n"
+    )
+    items, confidence = parse_menu_locally(text)
+    assert items == []
+    assert confidence == 0.0
+
+
+def test_bare_trailing_number_in_latin_name_is_kept():
+    items, _ = parse_menu_locally("Pho 24\nCoke - 5")
+    assert names(items) == ["Pho 24", "Coke"]
+
+
+def test_skip_gate_uses_local_items_when_all_have_ingredients(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        main, "call_sorux_for_menu_items", lambda text, settings: calls.append(text)
+    )
+    items = extract_menu_items(
+        "Kung Pao Chicken: chicken, peanut $14\nMapo Tofu: tofu, chili $12",
+        Settings(menu_parser_threshold=0.8),
+    )
+    assert calls == []
+    assert names(items) == ["Kung Pao Chicken", "Mapo Tofu"]
+
+
+def test_skip_gate_calls_llm_when_ingredients_are_missing(monkeypatch):
+    llm_items = [main.MenuItem(name="Kung Pao Chicken", ingredients=["peanut"])]
+    calls = []
+
+    def fake_llm(text, settings):
+        calls.append(text)
+        return llm_items
+
+    monkeypatch.setattr(main, "call_sorux_for_menu_items", fake_llm)
+    text = "Kung Pao Chicken: chicken, peanut $14\nPad Thai $10\nMapo Tofu: tofu $12"
+    items = extract_menu_items(text, Settings(menu_parser_threshold=0.1))
+    assert calls == [text]
+    assert items == llm_items
+
+
+def test_skip_gate_falls_back_to_local_items_when_llm_fails(monkeypatch):
+    monkeypatch.setattr(main, "call_sorux_for_menu_items", lambda text, settings: None)
+    items = extract_menu_items("Kung Pao Chicken $12\nPad Thai $10", Settings())
+    assert names(items) == ["Kung Pao Chicken", "Pad Thai"]
+
+
+def test_hours_address_and_phone_lines_are_not_dishes():
+    text = (
+        "营业时间：10:00-22:00\n"
+        "地址：人民路88号\n"
+        "电话：12345678\n"
+        "鱼香肉丝：猪肉、木耳\n"
+        "宫保鸡丁：鸡肉、花生\n"
+    )
+    items, confidence = parse_menu_locally(text)
+    assert names(items) == ["鱼香肉丝", "宫保鸡丁"]
+    assert confidence < 0.8
+
+
+def test_english_info_lines_are_not_dishes():
+    text = (
+        "Open daily 10:00-22:00\n"
+        "Tel: 555-1234\n"
+        "Hours: 11:00 - 21:30\n"
+        "Add: 12 Main St\n"
+        "Kung Pao Chicken: chicken, peanut - $14\n"
+        "Pad Thai: noodles, peanut $10\n"
+    )
+    items, _ = parse_menu_locally(text)
+    assert names(items) == ["Kung Pao Chicken", "Pad Thai"]
+
+
+def test_skip_gate_calls_llm_for_menu_with_info_lines(monkeypatch):
+    calls = []
+
+    def fake_llm(text, settings):
+        calls.append(text)
+        return [main.MenuItem(name="宫保鸡丁", ingredients=["鸡肉", "花生"])]
+
+    monkeypatch.setattr(main, "call_sorux_for_menu_items", fake_llm)
+    text = "营业时间：10:00-22:00\n地址：人民路88号\n电话：12345678\n宫保鸡丁：鸡肉、花生"
+    items = extract_menu_items(text, Settings())
+    assert calls == [text]
+    assert names(items) == ["宫保鸡丁"]
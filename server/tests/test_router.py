@@ -0,0 +1,56 @@
+import main
+from main import Metrics, Settings, route_tiers
+
+
+def fast_settings():
+    return Settings(text_model="strong", text_model_fast="fast")
+
+
+def test_fast_tier_keeps_probing_and_recovers(monkeypatch):
+    metrics = Metrics()
+    monkeypatch.setattr(main, "METRICS", metrics)
+    settings = fast_settings()
+    features = {"chars": 100, "items": 3}
+    for _ in range(5):
+        metrics.observe("sorux_text_fast", 900.0)
+        metrics.observe("sorux_text_strong_small", 300.0)
+
+    routes = [route_tiers("text", features, settings)[0] for _ in range(2000)]
+    assert 0 < routes.count("fast") < 400
+    assert metrics.snapshot()["router_text_probe"] == routes.count("fast")
+
+    for _ in range(20):
+        metrics.observe("sorux_text_fast", 100.0)
+    assert route_tiers("text", features, settings) == ["fast", "strong"]
+
+
+def test_large_strong_calls_do_not_penalize_fast_tier(monkeypatch):
+    metrics = Metrics()
+    monkeypatch.setattr(main, "METRICS", metrics)
+    for _ in range(5):
+        metrics.observe("sorux_text_fast", 500.0)
+        metrics.observe("sorux_text_strong", 200.0)
+    features = {"chars": 100, "items": 3}
+    assert route_tiers("text", features, fast_settings()) == ["fast", "strong"]
+    large = {"chars": 50000, "items": 3}
+    assert route_tiers("text", large, fast_settings()) == ["strong"]
+
+
+def test_fast_tier_error_cascades_to_strong(monkeypatch):
+    metrics = Metrics()
+    monkeypatch.setattr(main, "METRICS", metrics)
+    models = []
+
+    def fake_chat(messages, model, timeout, settings):
+        models.append(model)
+        if model == "fast":
+            return None, "SoruxGPT 404: model not found"
+        return '{"menu_items": []}', None
+
+    monkeypatch.setattr(main, "call_sorux_chat", fake_chat)
+    content, error = main.call_sorux_routed(
+        [], "text", {"chars": 100, "items": 3}, 10.0, lambda text: True, fast_settings()
+    )
+    assert models == ["fast", "strong"]
+    assert (content, error) == ('{"menu_items": []}', None)
+    assert metrics.snapshot()["router_text_cascade"] == 1
@@ -0,0 +1,42 @@
+import pytest
+
+import main
+from main import SettingsHolder, load_settings
+
+
+BASE = {"SORUXGPT_API_KEY": "key"}
+
+
+def test_integer_settings_are_parsed_strictly():
+    settings = load_settings({**BASE, "JOB_WORKERS": "3", "ANALYZE_IMAGE_MAX_FILES": "12"})
+    assert settings.job_workers == 3
+    assert settings.analyze_image_max_files == 12
+    for value in ("0", "0.5", "-1", "two", "2.0"):
+        with pytest.raises(ValueError):
+            load_settings({**BASE, "ANALYZE_IMAGE_CONCURRENCY": value})
+
+
+def test_float_settings_reject_typos():
+    assert load_settings({**BASE, "SORUXGPT_TEXT_TIMEOUT_SECONDS": "45"}).text_timeout == 45.0
+    for value in ("45s", "0", "-3", "nan"):
+        with pytest.raises(ValueError):
+            load_settings({**BASE, "SORUXGPT_TEXT_TIMEOUT_SECONDS": value})
+
+
+def test_settings_watch_accepts_zero_in_any_form():
+    for value in ("0", "0.0", "00"):
+        assert load_settings({**BASE, "SETTINGS_WATCH_SECONDS": value}).settings_watch_seconds == 0.0
+    assert load_settings({**BASE, "SETTINGS_WATCH_SECONDS": "5"}).settings_watch_seconds == 5.0
+    for value in ("-1", "off"):
+        with pytest.raises(ValueError):
+            load_settings({**BASE, "SETTINGS_WATCH_SECONDS": value})
+
+
+def test_invalid_reload_keeps_previous_snapshot(monkeypatch):
+    holder = SettingsHolder(load_settings({**BASE, "SORUXGPT_TEXT_TIMEOUT_SECONDS": "45"}))
+    previous = holder.current
+    monkeypatch.setattr(
+        main, "read_env_source", lambda: {**BASE, "SORUXGPT_TEXT_TIMEOUT_SECONDS": "45s"}
+    )
+    assert holder.reload() is False
+    assert holder.current is previous
@@ -0,0 +1,19 @@
+import hashlib
+import json
+from typing import List
+
+
+def messages_digest(messages: List[dict]) -> str:
+    def strip_images(value: object) -> object:
+        if isinstance(value, dict):
+            if value.get("type") == "image_url":
+                return {"type": "image_url"}
+            return {key: strip_images(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [strip_images(item) for item in value]
+        return value
+
+    encoded = json.dumps(
+        strip_images(messages), sort_keys=True, ensure_ascii=False
+    ).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
@@ -0,0 +1,354 @@
+import argparse
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+
+from traffic_digest import messages_digest
+
+
+def load_records(log_path: str) -> list[dict]:
+    records = []
+    with open(log_path, encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                print("warning: skipping malformed log line")
+    return records
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class UpstreamStub:
+    def __init__(self, records: list[dict], speed: float) -> None:
+        self.replies: dict[str, deque] = defaultdict(deque)
+        for record in records:
+            for call in record.get("upstream", []):
+                self.replies[call["digest"]].append(call)
+        self.speed = speed
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", free_port()), self.handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def next_reply(self, digest: str) -> dict | None:
+        with self.lock:
+            queue = self.replies.get(digest)
+            if not queue:
+                self.misses += 1
+                return None
+            return queue.popleft()
+
+    def handler(self) -> type:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length))
+                    digest = messages_digest(payload.get("messages", []))
+                except Exception:
+                    digest = ""
+                call = stub.next_reply(digest)
+                if call is None:
+                    self.reply(500, {"error": {"message": "no recorded reply"}})
+                    return
+                time.sleep(call.get("latency_ms", 0) / 1000 / stub.speed)
+                if call.get("status") is None:
+                    error = call.get("error") or "upstream error"
+                    self.reply(504, {"error": {"message": error}})
+                    return
+                self.reply(call["status"], call.get("body") or "")
+
+            def reply(self, status: int, body: object) -> None:
+                if not isinstance(body, str):
+                    body = json.dumps(body)
+                encoded = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def log_message(self, format: str, *args: object) -> None:
+                pass
+
+        return Handler
+
+    def __enter__(self) -> "UpstreamStub":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_candidate(server_path: str, upstream_url: str) -> tuple[subprocess.Popen, str]:
+    app_file = Path(server_path).resolve()
+    port = free_port()
+    env = dict(os.environ)
+    env.pop("TRAFFIC_RECORD_PATH", None)
+    env["SORUXGPT_BASE_URL"] = upstream_url
+    env["SORUXGPT_API_KEY"] = env.get("SORUXGPT_API_KEY") or "replay"
+    cmd = [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        f"{app_file.stem}:app",
+        "--app-dir",
+        str(app_file.parent),
+        "--host",
+        "127.0.0.1",
+        "--port",
+        str(port),
+        "--log-level",
+        "warning",
+    ]
+    process = subprocess.Popen(cmd, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"candidate {server_path} exited during startup.")
+        try:
+            httpx.get(f"{base_url}/openapi.json", timeout=1.0)
+            return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f"candidate {server_path} did not start within 30s.")
+
+
+def synthesize_bytes(size: int, seed: str) -> bytes:
+    block = hashlib.sha256(seed.encode("utf-8")).digest()
+    return (block * (size // len(block) + 1))[:size]
+
+
+def build_request_kwargs(record: dict) -> dict:
+    request = record.get("request") or {}
+    kind = request.get("kind")
+    if kind == "json":
+        return {"json": request.get("body")}
+    if kind == "multipart" and "fields" in request:
+        data: dict[str, str] = {}
+        files = []
+        for index, (key, field) in enumerate(request["fields"]):
+            if field.get("kind") == "file":
+                content = synthesize_bytes(field.get("size", 0), field.get("sha256", ""))
+                files.append(
+                    (key, (f"replay-{index}", content, field.get("content_type")))
+                )
+            else:
+                data[key] = field.get("value", "")
+        return {"data": data, "files": files}
+    return {}
+
+
+def send_record(client: httpx.Client, base_url: str, record: dict) -> dict:
+    start = time.perf_counter()
+    try:
+        response = client.request(
+            record.get("method", "POST"),
+            f"{base_url}{record['path']}",
+            **build_request_kwargs(record)
+        )
+        status = response.status_code
+        try:
+            payload = response.json()
+        except Exception:
+            payload = {"size": len(response.content)}
+    except httpx.HTTPError as exc:
+        status = 0
+        payload = {"error": str(exc)}
+    return {
+        "path": record["path"],
+        "status": status,
+        "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+        "response": payload,
+    }
+
+
+def replay(
+    server_path: str,
+    records: list[dict],
+    concurrency: int,
+    speed: float,
+    timeout: float
+) -> list[dict]:
+    with UpstreamStub(records, speed) as stub:
+        process, base_url = start_candidate(server_path, stub.base_url)
+        try:
+            with httpx.Client(timeout=timeout) as client:
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    results = list(
+                        pool.map(
+                            lambda record: send_record(client, base_url, record),
+                            records
+                        )
+                    )
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+        if stub.misses:
+            print(f"warning: {server_path} made {stub.misses} unrecorded upstream calls")
+    return results
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(results: list[dict]) -> dict[str, dict]:
+    by_path: dict[str, list[float]] = defaultdict(list)
+    for result in results:
+        by_path[result["path"]].append(result["latency_ms"])
+    return {
+        path: {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": max(values),
+        }
+        for path, values in sorted(by_path.items())
+    }
+
+
+def compare(baseline: list[dict], candidate: list[dict]) -> dict:
+    mismatches = []
+    for index, (before, after) in enumerate(zip(baseline, candidate)):
+        if before["status"] != after["status"] or before["response"] != after["response"]:
+            mismatches.append(
+                {
+                    "index": index,
+                    "path": before["path"],
+                    "baseline": {"status": before["status"], "response": before["response"]},
+                    "candidate": {"status": after["status"], "response": after["response"]},
+                }
+            )
+    return {
+        "baseline": summarize(baseline),
+        "candidate": summarize(candidate),
+        "payload_mismatches": len(mismatches),
+        "mismatch_samples": mismatches[:10],
+    }
+
+
+def print_report(report: dict, baseline_label: str) -> None:
+    print(f"{'path':<20} {'side':<10} {'count':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    paths = sorted(set(report["baseline"]) | set(report["candidate"]))
+    for path in paths:
+        for side, label in (("baseline", baseline_label), ("candidate", "candidate")):
+            stats = report[side].get(path)
+            if not stats:
+                continue
+            print(
+                f"{path:<20} {label:<10} {stats['count']:>6} "
+                f"{stats['p50']:>9.1f} {stats['p90']:>9.1f} "
+                f"{stats['p99']:>9.1f} {stats['max']:>9.1f}"
+            )
+    print(f"payload mismatches: {report['payload_mismatches']}")
+    for sample in report["mismatch_samples"]:
+        print(f"  #{sample['index']} {sample['path']}")
+        print(f"    {baseline_label}: {json.dumps(sample['baseline'], ensure_ascii=False)[:200]}")
+        print(f"    candidate: {json.dumps(sample['candidate'], ensure_ascii=False)[:200]}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Replay recorded traffic against a candidate server build."
+    )
+    parser.add_argument("--log", required=True, help="Log written via TRAFFIC_RECORD_PATH.")
+    parser.add_argument(
+        "--server",
+        default=str(Path(__file__).resolve().parent / "main.py"),
+        help="Candidate main.py to replay against."
+    )
+    parser.add_argument(
+        "--baseline-server",
+        help="Second main.py to replay and diff against. Defaults to the recorded run."
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Parallel requests. Values above 1 may reorder identical upstream calls."
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Divide recorded upstream latencies by this factor."
+    )
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--report", help="Write the comparison as JSON to this path.")
+    args = parser.parse_args()
+
+    records = load_records(args.log)
+    # Job ids differ between runs and job workers do not record upstream calls.
+    replayable = [record for record in records if not record["path"].startswith("/jobs/")]
+    if len(replayable) < len(records):
+        skipped = len(records) - len(replayable)
+        print(f"warning: skipping {skipped} /jobs/ requests; job mode is not replayable")
+        records = replayable
+    if not records:
+        raise SystemExit(f"No records found in {args.log}.")
+    print(f"Replaying {len(records)} requests against {args.server}")
+    concurrency = max(1, args.concurrency)
+    speed = args.speed if args.speed > 0 else 1.0
+    candidate = replay(args.server, records, concurrency, speed, args.timeout)
+    if args.baseline_server:
+        print(f"Replaying {len(records)} requests against {args.baseline_server}")
+        baseline = replay(args.baseline_server, records, concurrency, speed, args.timeout)
+        baseline_label = "baseline"
+    else:
+        baseline = [
+            {
+                "path": record["path"],
+                "status": record.get("status", 0),
+                "latency_ms": record.get("latency_ms", 0.0),
+                "response": record.get("response"),
+            }
+            for record in records
+        ]
+        baseline_label = "recorded"
+    report = compare(baseline, candidate)
+    print_report(report, baseline_label)
+    if args.report:
+        Path(args.report).write_text(
+            json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+        print(f"Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()